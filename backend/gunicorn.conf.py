@@ -0,0 +1,29 @@
+# Configuração do gunicorn (carregada automaticamente a partir do diretório atual)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# gthread: várias threads por worker. A inferência do Basic Pitch (TensorFlow) e as
+# chamadas de rede liberam o GIL, então requisições longas não bloqueiam as demais.
+worker_class = "gthread"
+# Cada worker carrega o próprio modelo do Basic Pitch; prefira mais threads a mais workers
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# Separação na MusicAI + geração de MIDI podem levar minutos
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "600"))
+
+
+# Com preload_app o app é importado uma única vez no master (no setup do Arbiter,
+# antes do on_starting) e os workers o herdam no fork. O modelo do Basic Pitch
+# continua carregado sob demanda em cada worker: o TensorFlow não sobrevive a um
+# fork depois de inicializado.
+preload_app = True
+
+
+def on_starting(server):
+    # cria as tabelas uma única vez, no processo master, antes de iniciar os workers;
+    # init_db fecha as conexões que abriu, então nenhuma é herdada no fork
+    from main import init_db
+
+    init_db()
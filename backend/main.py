@@ -1,48 +1,226 @@
 import os
+import gzip
+import logging
+import hashlib
 import zipfile
 import io
 import tempfile
-import glob
 import shutil
+import re
 import uuid
-import yt_dlp
-from flask import Flask, jsonify, send_file, request
+import fcntl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+import orjson
+from cachetools import TLRUCache, TTLCache
+from flask import Flask, Response, jsonify, send_file, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from musicai_sdk import MusicAiClient
-from basic_pitch.inference import predict
-from basic_pitch import ICASSP_2022_MODEL_PATH
-import pretty_midi
-import traceback
+import musicai_sdk.client as musicai_client_module
+from musicai_sdk.utils import extract_file_extension_from_url
+import numpy as np
 
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_bcrypt import Bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from models import db, User, Job 
+from utils.youtube import download_youtube_audio
 
 # ------------------------
 # Setup and configuration
 # ------------------------
 load_dotenv()
+
+# ------------------------
+# Logging (nível via LOG_LEVEL; mensagens abaixo do nível não são formatadas)
+# ------------------------
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="[%(levelname)s] %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Serializa/parseia JSON com orjson (extensão em C) no lugar do json da stdlib."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///music_app.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# confere a conexão do pool antes de usá-la (o tamanho padrão já cobre as threads do gunicorn;
+# a geração de MIDI em segundo plano não acessa o banco)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
 app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY", "chavesecreta")
 
+# Respostas JSON acima deste tamanho são comprimidas com gzip
+GZIP_MIN_SIZE = 1024
+
+
+@app.after_request
+def gzip_json_response(response):
+    """Comprime respostas JSON grandes quando o cliente aceita gzip.
+    ZIP/MIDI e respostas em streaming ficam de fora (já comprimidos ou sem corpo em memória).
+    """
+    if (response.mimetype != "application/json"
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or "gzip" not in request.headers.get("Accept-Encoding", "").lower()):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
 db.init_app(app)
 jwt = JWTManager(app)
 
+# Senhas novas usam argon2id; o bcrypt fica só para verificar hashes antigos ($2b$...),
+# que são convertidos para argon2 no próximo login bem-sucedido
 bcrypt = Bcrypt(app)
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+# Hashes usados para igualar o tempo do login: usuário inexistente verifica contra o
+# dummy argon2, e enquanto houver hashes bcrypt na tabela todo login paga também uma
+# verificação do outro algoritmo. Assim a resposta não revela se o usuário existe.
+DUMMY_PASSWORD_HASH = password_hasher.hash(uuid.uuid4().hex)
+LEGACY_DUMMY_PASSWORD_HASH = bcrypt.generate_password_hash(uuid.uuid4().hex).decode('utf-8')
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    """Confere a senha contra o hash salvo (argon2 ou bcrypt legado).
+    Retorna (válida, precisa_rehash)."""
+    if password_hash.startswith("$argon2"):
+        try:
+            password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, password_hasher.check_needs_rehash(password_hash)
+    return bcrypt.check_password_hash(password_hash, password), True
+
+
+# Existem hashes bcrypt na tabela? Consultado uma vez por processo (None = ainda não
+# consultado). Cadastros novos já usam argon2, então o valor só pode passar de True para
+# False: é reconsultado apenas quando um login migra um hash bcrypt.
+_legacy_password_hashes = None
+
+
+def _query_legacy_password_hashes() -> bool:
+    return db.session.execute(
+        db.select(User.id).where(db.not_(User.password_hash.startswith("$argon2"))).limit(1)
+    ).first() is not None
+
+
+def legacy_password_hashes_exist() -> bool:
+    """Ainda existe algum usuário com hash bcrypt (não migrado para argon2)?"""
+    global _legacy_password_hashes
+    if _legacy_password_hashes is None:
+        _legacy_password_hashes = _query_legacy_password_hashes()
+    return _legacy_password_hashes
+
+
+def legacy_password_hash_migrated():
+    """Chamado depois que um hash bcrypt foi trocado por argon2: confere se era o último."""
+    global _legacy_password_hashes
+    if _legacy_password_hashes and not _query_legacy_password_hashes():
+        _legacy_password_hashes = False
+
+
+def init_db():
+    """Cria as tabelas que ainda não existem. Roda uma vez por deploy (no master do
+    gunicorn ou via `flask --app main init-db`), não a cada import de worker."""
+    with app.app_context():
+        db.create_all()
+        # create_all não altera tabelas já existentes: cria os índices que faltam
+        # (ex.: jobs.musicai_job_id, consultado a cada poll do status)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(bind=db.engine, checkfirst=True)
+                except SQLAlchemyError as e:
+                    logger.warning("Não foi possível criar o índice %s: %s", index.name, e)
+        # roda no master do gunicorn antes do fork: não deixa conexões abertas no pool
+        # para os workers herdarem
+        db.engine.dispose()
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    init_db()
+    logger.info("Banco de dados inicializado")
 
-with app.app_context():
-    db.create_all()
 
 MUSICAI_API_KEY = os.getenv("MUSICAI_API_KEY")
 MUSICAI_WORKFLOW_TITLE = os.getenv("MUSICAI_WORKFLOW_TITLE")
 MUSICAI_WORKFLOW_SLUG = os.getenv("MUSICAI_WORKFLOW_SLUG")
+# A SDK da MusicAI usa requests.get/put/post do módulo, abrindo uma conexão TCP+TLS
+# por chamada. Uma Session compartilhada mantém conexões keep-alive entre requisições.
+# Falhas de conexão e 502/503/504 são repetidas com backoff; o Retry do urllib3 só repete
+# por status os métodos idempotentes (o POST de add_job não é reenviado e duplicado).
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), raise_on_status=False),
+))
+musicai_client_module.requests = http_session
 music_ai = MusicAiClient(api_key=MUSICAI_API_KEY)
+
+# O frontend consulta o status do job a cada poucos segundos: respostas de get_job ficam
+# em memória por pouco tempo enquanto o job roda e por mais tempo depois que termina.
+JOB_STATUS_TTL = 5
+JOB_TERMINAL_TTL = 600
+TERMINAL_JOB_STATUSES = {"SUCCEEDED", "FAILED"}
+
+
+def _job_cache_ttu(_job_id, job, now):
+    ttl = JOB_TERMINAL_TTL if job.get("status") in TERMINAL_JOB_STATUSES else JOB_STATUS_TTL
+    return now + ttl
+
+
+_job_cache = TLRUCache(maxsize=1024, ttu=_job_cache_ttu)
+_job_cache_lock = threading.Lock()
+
+
+def get_job_cached(job_id: str) -> dict:
+    """`music_ai.get_job` com cache curto em memória (por processo)."""
+    with _job_cache_lock:
+        job = _job_cache.get(job_id)
+    if job is None:
+        job = music_ai.get_job(job_id)
+        with _job_cache_lock:
+            _job_cache[job_id] = job
+    return job
+
 # Cache directory for downloaded audio and generated ZIP/MIDI
 CACHE_DIR = os.path.join(os.getcwd(), ".cache")
 os.makedirs(CACHE_DIR, exist_ok=True)
@@ -54,8 +232,10 @@ def video_cache_dir(video_id: str) -> str:
     return path
 
 
-def cached_paths_for_video(video_id: str):
-    d = video_cache_dir(video_id)
+@lru_cache(maxsize=4096)
+def _scan_piano_candidate(d: str, dir_mtime_ns: int):
+    """Procura um stem de piano em `d`. O mtime da pasta faz parte da chave do cache:
+    criar, remover ou renomear um arquivo nela invalida o resultado automaticamente."""
     # try to discover existing piano stem with common extensions
     audio_exts = ['.mp3', '.wav', '.m4a', '.flac']
     piano_candidate = None
@@ -68,6 +248,13 @@ def cached_paths_for_video(video_id: str):
                     break
         if piano_candidate:
             break
+    return piano_candidate
+
+
+def cached_paths_for_video(video_id: str):
+    d = video_cache_dir(video_id)
+    # roda a cada poll: evita listar a pasta enquanto ela não muda
+    piano_candidate = _scan_piano_candidate(d, os.stat(d).st_mtime_ns)
 
     default_piano = os.path.join(d, f"{video_id}_piano.mp3")
     return {
@@ -77,28 +264,60 @@ def cached_paths_for_video(video_id: str):
         'midi': os.path.join(d, f"{video_id}.mid"),
     }
 
+# Um lock por job: evita que vários pollers do mesmo job gerem o MIDI ao mesmo tempo.
+# Cada entrada guarda [lock, usuários] e sai do dicionário quando o último usuário libera.
+_job_locks = {}
+_job_locks_guard = threading.Lock()
+
+
+@contextmanager
+def job_lock(job_id: str):
+    with _job_locks_guard:
+        entry = _job_locks.setdefault(job_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _job_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _job_locks[job_id]
+
+
+@contextmanager
+def dir_file_lock(directory: str):
+    """Lock exclusivo entre processos (flock) num arquivo `.lock` dentro da pasta: os
+    workers do gunicorn não compartilham o job_lock, mas gravam na mesma pasta de cache."""
+    with open(os.path.join(directory, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# v=ID (watch), youtu.be/ID, /embed/ID e /shorts/ID; o id vira nome de pasta no cache,
+# então só aceita os caracteres usados pelo YouTube
+_YOUTUBE_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/embed/|/shorts/)([A-Za-z0-9_-]+)')
+
+
+@lru_cache(maxsize=1024)
 def extract_youtube_id(url: str) -> str:
     """Tenta extrair o id do vídeo do YouTube a partir da URL."""
     # exemplos: https://www.youtube.com/watch?v=ID, https://youtu.be/ID
-    try:
-        if "v=" in url:
-            # pega parâmetro v
-            import urllib.parse as _up
-            q = _up.urlparse(url)
-            params = _up.parse_qs(q.query)
-            vid = params.get("v", [None])[0]
-            if vid:
-                return vid
-        # youtu.be/ID
-        if "youtu.be/" in url:
-            parts = url.split("youtu.be/")
-            if len(parts) > 1:
-                return parts[1].split("?")[0]
-    except Exception:
-        pass
+    m = _YOUTUBE_ID_RE.search(url)
+    if m:
+        return m.group(1)
     # fallback: hash the URL
-    import hashlib as _hash
-    return _hash.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+# O corpo do /health não muda depois da inicialização: serializa uma única vez
+HEALTH_RESPONSE_BODY = orjson.dumps({"status": "healthy", "musicai_configured": bool(MUSICAI_API_KEY)})
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Verificação leve de saúde para load balancers/probes (não toca no banco nem na MusicAI)."""
+    return Response(HEALTH_RESPONSE_BODY, status=200, mimetype="application/json")
 
 # ------------------------
 # Rotas de Autenticação
@@ -111,13 +330,18 @@ def register():
     if not data or not data.get('username') or not data.get('password') or not data.get('email'):
         return jsonify({"msg": "Dados incompletos"}), 400
 
-    if User.query.filter_by(username=data['username']).first():
+    # uma única consulta para os dois conflitos possíveis (usuário ou email)
+    existing = db.session.execute(
+        db.select(User.username, User.email).where(
+            db.or_(User.username == data['username'], User.email == data['email'])
+        )
+    ).all()
+    if any(row.username == data['username'] for row in existing):
         return jsonify({"msg": "Usuário já existe"}), 400
-    
-    if User.query.filter_by(email=data['email']).first():
+    if existing:
         return jsonify({"msg": "Email já cadastrado"}), 400
 
-    hashed_password = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    hashed_password = hash_password(data['password'])
 
     new_user = User(
         username=data['username'],
@@ -129,6 +353,10 @@ def register():
         db.session.add(new_user)
         db.session.commit()
         return jsonify({"msg": "Usuário criado com sucesso!"}), 201
+    except IntegrityError:
+        # cadastro simultâneo com o mesmo usuário/email: as colunas são unique
+        db.session.rollback()
+        return jsonify({"msg": "Usuário ou email já cadastrado"}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -143,7 +371,21 @@ def login():
 
     user = User.query.filter_by(username=data['username']).first()
 
-    if user and bcrypt.check_password_hash(user.password_hash, data['password']):
+    stored_hash = user.password_hash if user is not None else DUMMY_PASSWORD_HASH
+    valid, needs_rehash = verify_password(stored_hash, data['password'])
+    if legacy_password_hashes_exist():
+        # durante a migração bcrypt -> argon2 todo login custa argon2 + bcrypt, qualquer
+        # que seja o hash do usuário (ou a falta dele)
+        other_dummy = DUMMY_PASSWORD_HASH if not stored_hash.startswith("$argon2") else LEGACY_DUMMY_PASSWORD_HASH
+        verify_password(other_dummy, data['password'])
+
+    if user is not None and valid:
+        if needs_rehash:
+            # migra hashes bcrypt (ou argon2 com parâmetros antigos) para os atuais
+            user.password_hash = hash_password(data['password'])
+            db.session.commit()
+            if not stored_hash.startswith("$argon2"):
+                legacy_password_hash_migrated()
         access_token = create_access_token(identity=str(user.id))
         return jsonify({
             "msg": "Login realizado com sucesso",
@@ -157,7 +399,9 @@ def login():
 @jwt_required()
 def get_user_data():
     current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
+    user = db.session.get(User, int(current_user_id))
+    if user is None:
+        return jsonify({"msg": "Usuário não encontrado"}), 404
     return jsonify({
         "id": user.id,
         "username": user.username,
@@ -168,43 +412,6 @@ def get_user_data():
 # Funções Utilitárias
 # ------------------------
 
-def download_youtube_audio_bytes(url: str) -> bytes:
-    """
-    Baixa o áudio do YouTube e retorna os bytes brutos.
-    Requer FFmpeg instalado no sistema.
-    """
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-        'no_warnings': True,
-    }
-
-    with tempfile.TemporaryDirectory() as temp_dir:
-        ydl_opts['outtmpl'] = os.path.join(temp_dir, '%(id)s.%(ext)s')
-        
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-
-            arquivos = glob.glob(os.path.join(temp_dir, "*.mp3"))
-            if not arquivos:
-                raise FileNotFoundError("O arquivo de áudio não foi gerado corretamente.")
-
-            caminho_arquivo = arquivos[0]
-
-            with open(caminho_arquivo, "rb") as f:
-                audio_bytes = f.read()
-
-            return audio_bytes
-
-        except Exception as e:
-            raise RuntimeError(f"Falha ao baixar áudio: {str(e)}")
-
 def filter_piano_stem(result_files: dict) -> dict:
     """
     Tenta retornar apenas o(s) arquivo(s) de stem de piano a partir do dicionário
@@ -215,14 +422,12 @@ def filter_piano_stem(result_files: dict) -> dict:
     if not result_files:
         return {}
 
-    # 1) chave que contenha 'piano'
-    for k in result_files.keys():
-        if 'piano' in k.lower():
-            return {k: result_files[k]}
-
-    # 2) às vezes o valor é um dict com nome/filename/path
+    # Uma única passada: 1) uma chave que contenha 'piano' tem prioridade e encerra a busca;
+    # 2) senão, ficam os itens cujo valor (ou nome/filename/path) mencione piano
     piano_candidates = {}
     for k, v in result_files.items():
+        if 'piano' in k.lower():
+            return {k: v}
         name = ''
         if isinstance(v, str):
             name = v
@@ -235,191 +440,607 @@ def filter_piano_stem(result_files: dict) -> dict:
         return piano_candidates
 
     # Nenhum piano encontrado — não retornar o mix completo
-    print('[WARN] filter_piano_stem: nenhum stem de piano identificado nos resultados')
+    logger.warning("filter_piano_stem: nenhum stem de piano identificado nos resultados")
     return {}
 
+# O Basic Pitch (e com ele o TensorFlow e o pretty_midi) é importado dentro das funções
+# de transcrição: workers que só atendem login/status não pagam o import nem a memória.
+
+# Formato do modelo do Basic Pitch: "tf", "onnx", "tflite" ou "coreml".
+# Vazio usa o padrão do pacote (TensorFlow quando instalado). "onnx" requer onnxruntime.
+BASIC_PITCH_MODEL_TYPE = os.getenv("BASIC_PITCH_MODEL_TYPE", "").strip().lower()
+# Caminho para um modelo próprio (ex.: ONNX quantizado em int8 ou TFLite em FP16);
+# o formato é deduzido da extensão e tem prioridade sobre BASIC_PITCH_MODEL_TYPE
+BASIC_PITCH_MODEL_PATH = os.getenv("BASIC_PITCH_MODEL_PATH", "").strip()
+
+_bp_model = None
+_bp_model_lock = threading.Lock()
+# O modelo é compartilhado entre threads. TensorFlow e ONNX Runtime aceitam chamadas
+# simultâneas; o interpretador do TFLite e o modelo CoreML não, então com eles o
+# predict roda um de cada vez.
+_bp_predict_lock = threading.Lock()
+
+
+def basic_pitch_model_path():
+    from basic_pitch import ICASSP_2022_MODEL_PATH, FilenameSuffix, build_icassp_2022_model_path
+
+    if BASIC_PITCH_MODEL_PATH:
+        return BASIC_PITCH_MODEL_PATH
+    if BASIC_PITCH_MODEL_TYPE:
+        return build_icassp_2022_model_path(FilenameSuffix[BASIC_PITCH_MODEL_TYPE])
+    return ICASSP_2022_MODEL_PATH
+
+
+def get_basic_pitch_model():
+    """Carrega o modelo do Basic Pitch uma única vez por processo e o reaproveita
+    entre requisições (predict() com um caminho recarrega o modelo a cada chamada)."""
+    global _bp_model
+    if _bp_model is None:
+        with _bp_model_lock:
+            if _bp_model is None:
+                from basic_pitch.inference import Model
+
+                model_path = basic_pitch_model_path()
+                model = Model(model_path)
+                if model.model_type == Model.MODEL_TYPES.ONNX:
+                    use_onnx_gpu_if_available(model, model_path)
+                _bp_model = model
+    return _bp_model
+
+
+def use_onnx_gpu_if_available(model, model_path):
+    """O Basic Pitch abre a sessão ONNX só com CPUExecutionProvider. Se o onnxruntime
+    tiver suporte a CUDA (pacote onnxruntime-gpu), reabre a sessão na GPU, mantendo a
+    CPU como fallback. O TensorFlow já usa a GPU sozinho quando disponível."""
+    import onnxruntime as ort
+
+    if "CUDAExecutionProvider" not in ort.get_available_providers():
+        return
+    model.model = ort.InferenceSession(
+        str(model_path), providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
+    )
+    logger.info("Basic Pitch (ONNX) rodando na GPU via CUDAExecutionProvider")
+
+# Janelas de áudio enviadas juntas ao modelo em cada chamada
+BASIC_PITCH_BATCH_SIZE = int(os.getenv("BASIC_PITCH_BATCH_SIZE", "16"))
+# Sobreposição entre janelas usada pelo Basic Pitch (em frames do modelo)
+BASIC_PITCH_OVERLAP_FRAMES = 30
+
+
+def run_basic_pitch(stem_path: str, model) -> dict:
+    """Equivalente ao `run_inference` do Basic Pitch, mas envia as janelas de áudio ao
+    modelo em lotes: o original chama o modelo uma vez para cada janela de ~2 s.
+    Só o modelo TensorFlow aceita lote variável; os demais seguem janela a janela.
+    """
+    from basic_pitch.constants import AUDIO_N_SAMPLES, FFT_HOP
+    from basic_pitch.inference import Model, get_audio_input, unwrap_output
+
+    overlap_len = BASIC_PITCH_OVERLAP_FRAMES * FFT_HOP
+    hop_size = AUDIO_N_SAMPLES - overlap_len
+    batch_size = BASIC_PITCH_BATCH_SIZE if model.model_type == Model.MODEL_TYPES.TENSORFLOW else 1
+    thread_safe = model.model_type in (Model.MODEL_TYPES.TENSORFLOW, Model.MODEL_TYPES.ONNX)
+    predict_lock = nullcontext() if thread_safe else _bp_predict_lock
+
+    output = {"note": [], "onset": [], "contour": []}
+    batch = []
+    audio_original_length = 0
+
+    def flush():
+        with predict_lock:
+            prediction = model.predict(np.concatenate(batch))
+        for k, v in prediction.items():
+            output[k].append(v)
+        batch.clear()
+
+    for audio_windowed, _, audio_original_length in get_audio_input(stem_path, overlap_len, hop_size):
+        batch.append(audio_windowed)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    return {
+        k: unwrap_output(np.concatenate(v), audio_original_length, BASIC_PITCH_OVERLAP_FRAMES)
+        for k, v in output.items()
+    }
+
+# Parâmetros de criação de notas (piano clássico); a duração mínima (ms) é convertida
+# para frames do modelo em note_creation_kwargs()
+BASIC_PITCH_NOTE_PARAMS = {
+    "onset_thresh": 0.6,
+    "frame_thresh": 0.3,
+    "min_note_ms": 50,
+    "min_freq": 27.5,
+    "max_freq": 4186.0,
+    # o MIDI de piano não usa pitch bend: nem calcula
+    "include_pitch_bends": False,
+}
+
+
+# Programa General MIDI do "Acoustic Grand Piano" (o mesmo que
+# pretty_midi.instrument_name_to_program('Acoustic Grand Piano') devolve)
+PIANO_PROGRAM = 0
+
+
+@lru_cache(maxsize=1)
+def note_creation_kwargs() -> dict:
+    """Argumentos para `model_output_to_notes` a partir de BASIC_PITCH_NOTE_PARAMS.
+    Calculado uma vez (os parâmetros são fixos); o dict é só desempacotado, nunca alterado."""
+    from basic_pitch.constants import AUDIO_SAMPLE_RATE, FFT_HOP
+
+    params = dict(BASIC_PITCH_NOTE_PARAMS)
+    min_note_ms = params.pop("min_note_ms")
+    params["min_note_len"] = int(np.round(min_note_ms / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+    return params
+
+# Cache de MIDIs endereçado pelo conteúdo do áudio: o mesmo stem não passa duas vezes pela inferência.
+# A chave inclui os parâmetros acima e o modelo escolhido, então alterá-los invalida o cache.
+MIDI_CACHE_DIR = os.path.join(CACHE_DIR, "midi")
+os.makedirs(MIDI_CACHE_DIR, exist_ok=True)
+MIDI_CACHE_PARAMS_KEY = hashlib.blake2b(
+    repr((sorted(BASIC_PITCH_NOTE_PARAMS.items()), BASIC_PITCH_MODEL_TYPE, BASIC_PITCH_MODEL_PATH)).encode(),
+    digest_size=4,
+).hexdigest()
+
+
+def audio_content_key(path: str) -> str:
+    """Hash BLAKE2b do arquivo de áudio, lido em blocos de 1 MiB."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Limite de espaço do cache de MIDIs; acima dele, os menos usados recentemente são removidos
+MIDI_CACHE_MAX_BYTES = int(os.getenv("MIDI_CACHE_MAX_MB", "256")) * 1024 * 1024
+_midi_cache_evict_lock = threading.Lock()
+
+
+def evict_midi_cache():
+    """Remove os MIDIs menos usados até o cache caber em MIDI_CACHE_MAX_BYTES.
+    Usa o mtime como relógio de uso (atualizado a cada acerto), pois o atime
+    costuma estar desativado (noatime/relatime) nos sistemas de arquivos."""
+    with _midi_cache_evict_lock:
+        entries = []
+        total = 0
+        with os.scandir(MIDI_CACHE_DIR) as it:
+            for entry in it:
+                if not entry.name.endswith('.mid') or not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= MIDI_CACHE_MAX_BYTES:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= MIDI_CACHE_MAX_BYTES:
+                break
+
+
+def copy_atomic(src: str, dst: str):
+    """Copia para um nome temporário único e renomeia sobre `dst`: o destino nunca é
+    reescrito no lugar. Cópia, não hardlink: um MIDI tem poucos KB, e arquivos servidos
+    e entradas do cache não compartilham o inode (nem o mtime usado pela remoção por LRU)."""
+    tmp_path = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
 def generate_midi_from_audio(stem_path: str, output_dir: str) -> str:
     """Gera MIDI otimizado para PIANO CLÁSSICO."""
     midi_file_name = os.path.splitext(os.path.basename(stem_path))[0] + '.mid'
     midi_output_path = os.path.join(output_dir, midi_file_name)
 
-    print(f"[DEBUG] Gerando MIDI para: {stem_path}")
+    logger.debug("Gerando MIDI para: %s", stem_path)
     try:
-        model_output, midi_data, note_events = predict(
-            stem_path, 
-            ICASSP_2022_MODEL_PATH,
-            onset_threshold=0.6, 
-            frame_threshold=0.3,
-            minimum_note_length=50,
-            minimum_frequency=27.5,
-            maximum_frequency=4186.0
+        cache_path = os.path.join(
+            MIDI_CACHE_DIR, f"{audio_content_key(stem_path)}_{MIDI_CACHE_PARAMS_KEY}.mid"
+        )
+        try:
+            copy_atomic(cache_path, midi_output_path)
+            os.utime(cache_path)  # marca o uso para a remoção por LRU
+            logger.info("MIDI encontrado no cache de conteúdo: %s", cache_path)
+            return midi_output_path
+        except FileNotFoundError:
+            pass  # ausente (ou removido pela limpeza do cache): gera de novo
+
+        import basic_pitch.note_creation as bp_notes
+
+        model_output = run_basic_pitch(stem_path, get_basic_pitch_model())
+        midi_data, note_events = bp_notes.model_output_to_notes(
+            model_output, **note_creation_kwargs()
         )
 
-        piano_program = pretty_midi.instrument_name_to_program('Acoustic Grand Piano')
-        
         for instrument in midi_data.instruments:
-            instrument.program = piano_program
+            instrument.program = PIANO_PROGRAM
             instrument.is_drum = False
-            instrument.pitch_bends = []
 
-        midi_data.write(midi_output_path)
+        # grava num nome temporário e renomeia: um arquivo já existente no destino é
+        # substituído, não truncado
+        tmp_output_path = f"{midi_output_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            midi_data.write(tmp_output_path)
+            os.replace(tmp_output_path, midi_output_path)
+        except Exception:
+            try:
+                os.remove(tmp_output_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        # Publica no cache de forma atômica para não expor arquivos parciais a outras threads
+        copy_atomic(midi_output_path, cache_path)
+        evict_midi_cache()
         return midi_output_path
 
     except Exception as e:
-        print(f"[WARN] Erro ao gerar MIDI para {stem_path}: {e}")
+        logger.warning("Erro ao gerar MIDI para %s: %s", stem_path, e)
         return None
 
-def create_zip_with_midi(result_files: dict) -> io.BytesIO:
-    with tempfile.TemporaryDirectory() as output_dir:
-        piano_files_map = filter_piano_stem(result_files)
+def generate_midis_from_audios(stem_paths, output_dir: str) -> list:
+    """Gera os MIDIs de vários stems em paralelo e retorna os caminhos gerados.
+    A inferência do Basic Pitch roda em código nativo (TensorFlow) e libera o GIL,
+    então threads já sobrepõem o trabalho entre stems.
+    """
+    stem_paths = list(stem_paths)
+    if len(stem_paths) <= 1:
+        results = [generate_midi_from_audio(p, output_dir) for p in stem_paths]
+    else:
+        max_workers = min(len(stem_paths), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda p: generate_midi_from_audio(p, output_dir), stem_paths))
+    return [r for r in results if r]
+
+# Áudio já comprimido: DEFLATE gasta CPU sem reduzir o tamanho, então vai como STORED
+ZIP_STORED_EXTENSIONS = {'.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac'}
+# MIDIs são pequenos e repetitivos: o nível 1 do zlib comprime quase o mesmo que o
+# padrão (6) com uma fração da CPU
+ZIP_DEFLATE_LEVEL = 1
+
+
+def zip_compress_type(file_name: str) -> int:
+    ext = os.path.splitext(file_name)[1].lower()
+    return zipfile.ZIP_STORED if ext in ZIP_STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Destino write-only (não pesquisável) para o ZipFile: guarda os bytes escritos
+    até que o gerador do ZIP os consuma."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# Tamanho dos blocos lidos de cada arquivo ao montar o ZIP
+ZIP_COPY_CHUNK_SIZE = 1 << 20
+
+
+def _stream_zip_dir(work_dir: tempfile.TemporaryDirectory, suffixes: tuple = None):
+    """Transmite o conteúdo de `work_dir` como ZIP, em partes, e remove a pasta ao final.
+    Com `suffixes`, inclui apenas os arquivos com essas extensões."""
+    try:
+        buffer = _ZipStreamBuffer()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
+            # scandir traz o tipo da entrada junto com o nome, sem um stat() por arquivo
+            with os.scandir(work_dir.name) as entries:
+                for entry in entries:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    if suffixes and not entry.name.lower().endswith(suffixes):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    zinfo = zipfile.ZipInfo(entry.name, date_time=time.localtime(st.st_mtime)[:6])
+                    zinfo.file_size = st.st_size
+                    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                    zinfo.compress_type = zip_compress_type(entry.name)
+                    # atributo público (compress_level) só a partir do Python 3.13
+                    zinfo._compresslevel = ZIP_DEFLATE_LEVEL
+
+                    # Copia em blocos e repassa ao cliente a cada bloco: um stem grande
+                    # não fica inteiro no buffer antes de começar a ser enviado
+                    with open(entry.path, 'rb') as src, zipf.open(zinfo, 'w') as dst:
+                        for chunk in iter(lambda: src.read(ZIP_COPY_CHUNK_SIZE), b''):
+                            dst.write(chunk)
+                            data = buffer.pop()
+                            if data:
+                                yield data
+        yield buffer.pop()
+    finally:
+        work_dir.cleanup()
+
+
+# Downloads simultâneos de stems (limitado para não estourar o rate limit da MusicAI)
+STEM_DOWNLOAD_WORKERS = 8
+STEM_DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
+def _download_stem(url: str, dest_path: str) -> str:
+    """Baixa um arquivo em blocos direto para o disco (sem `response.content` inteiro em memória)."""
+    # nome temporário único: dois downloads do mesmo stem não escrevem no mesmo arquivo
+    part_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    try:
+        with http_session.get(url, stream=True, timeout=(10, 300)) as r:
+            r.raise_for_status()
+            with open(part_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=STEM_DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(part_path, dest_path)
+    except Exception:
+        # com nomes únicos, um download interrompido não seria sobrescrito depois
+        try:
+            os.remove(part_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return dest_path
+
+
+def download_stems(files_map: dict, output_dir: str) -> dict:
+    """Equivalente ao `download_job_results` da SDK para um mapa {nome: url}, mas com os
+    downloads em paralelo pela sessão HTTP compartilhada. Salva como `{nome}.{ext}`."""
+    jobs = {}
+    for name, url in (files_map or {}).items():
+        if isinstance(url, str) and url.startswith("https://"):
+            file_name = f"{name}.{extract_file_extension_from_url(url)}"
+            jobs[name] = (url, os.path.join(output_dir, file_name))
+    if not jobs:
+        return {}
+
+    os.makedirs(output_dir, exist_ok=True)
+    if len(jobs) == 1:
+        (name, (url, dest)), = jobs.items()
+        return {name: _download_stem(url, dest)}
+
+    with ThreadPoolExecutor(max_workers=min(len(jobs), STEM_DOWNLOAD_WORKERS)) as executor:
+        futures = {name: executor.submit(_download_stem, url, dest) for name, (url, dest) in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def job_result_files(job_result: dict) -> dict:
+    """Extrai o mapa {nome: url} dos arquivos de um job da MusicAI. A SDK devolve os
+    arquivos em 'result'; as demais chaves cobrem variações do formato. Sem sub-dict,
+    assume que já recebeu o mapa."""
+    if not isinstance(job_result, dict):
+        return {}
+    for key in ('result', 'results', 'artifacts', 'files', 'outputs'):
+        if isinstance(job_result.get(key), dict):
+            return job_result[key]
+    return job_result
+
+
+def create_zip_with_midi(result_files: dict):
+    """Baixa o stem de piano e gera o MIDI; retorna um gerador que transmite o ZIP
+    em partes (sem montar o arquivo inteiro em memória)."""
+    work_dir = tempfile.TemporaryDirectory()
+    output_dir = work_dir.name
+    try:
+        piano_files_map = filter_piano_stem(job_result_files(result_files))
 
         if not piano_files_map:
-            print('[WARN] create_zip_with_midi: nenhum stem de piano para baixar; retornando zip vazio')
-            memory_zip = io.BytesIO()
-            with zipfile.ZipFile(memory_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
-                pass
-            memory_zip.seek(0)
-            return memory_zip
+            logger.warning("create_zip_with_midi: nenhum stem de piano para baixar; retornando zip vazio")
+            return _stream_zip_dir(work_dir)
 
-        print("[INFO] Baixando stem de piano...")
-        local_files = music_ai.download_job_results(piano_files_map, output_dir)
+        logger.info("Baixando stem de piano...")
+        local_files = download_stems(piano_files_map, output_dir)
 
-        print("[INFO] Gerando MIDI de alta precisão (apenas piano)...")
-        for stem_path in local_files.values():
-            generate_midi_from_audio(stem_path, output_dir)
+        logger.info("Gerando MIDI de alta precisão (apenas piano)...")
+        generate_midis_from_audios(local_files.values(), output_dir)
+    except Exception:
+        work_dir.cleanup()
+        raise
 
-        print("[INFO] Zipando resultados...")
-        memory_zip = io.BytesIO()
-        with zipfile.ZipFile(memory_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file_name in os.listdir(output_dir):
-                full_path = os.path.join(output_dir, file_name)
-                zipf.write(full_path, arcname=file_name)
+    # o stem de áudio só serve de entrada para o Basic Pitch: o ZIP leva apenas os MIDIs
+    logger.info("Zipando resultados...")
+    return _stream_zip_dir(work_dir, suffixes=('.mid',))
 
-        memory_zip.seek(0)
-        return memory_zip
 
+# Arquivos de áudio com "piano" no nome (ignora .mid e downloads parciais .part)
+_PIANO_STEM_RE = re.compile(r'piano.*\.(?:mp3|wav|m4a|flac|ogg|aac)$', re.IGNORECASE)
 
-def create_first_midi_bytes(result_files: dict, cache_dir: str = None):
-    """Gera MIDIs a partir dos stems e retorna os bytes do primeiro arquivo .mid gerado e seu nome.
-    Se `cache_dir` for fornecido, os stems e MIDIs são gravados nessa pasta (persistente).
+
+def find_local_piano_stems(d: str) -> list:
+    """Stems de piano já presentes na pasta de cache do vídeo (plana, sem subpastas).
+    Os nomes no padrão `*_piano.*` têm prioridade, como no download normalizado."""
+    try:
+        with os.scandir(d) as it:
+            found = [e.path for e in it if e.is_file() and _PIANO_STEM_RE.search(e.name)]
+    except FileNotFoundError:
+        return []
+    exact = [p for p in found if '_piano.' in os.path.basename(p).lower()]
+    return exact or found
+
+
+def create_first_midi(result_files: dict, cache_dir: str):
+    """Gera MIDIs a partir dos stems e retorna o caminho do primeiro arquivo .mid gerado
+    (ou None). Stems e MIDIs são gravados em `cache_dir` (pasta persistente do vídeo ou
+    do job), onde também são procurados stems de piano já baixados.
     """
-    use_temp = cache_dir is None
-    if use_temp:
-        work_dir_ctx = tempfile.TemporaryDirectory()
-        output_dir = work_dir_ctx.__enter__()
-    else:
-        output_dir = cache_dir
+    if not isinstance(result_files, dict):
+        logger.warning("create_first_midi: result_files inesperado (não dict)")
+        return None
+
+    # só o stem de piano é baixado e transcrito; os demais stems não são usados
+    piano_files_map = filter_piano_stem(job_result_files(result_files))
 
+    local_files = {}
+    if piano_files_map:
+        logger.info("Baixando stem de piano para gerar MIDI...")
+        try:
+            local_files = download_stems(piano_files_map, cache_dir)
+        except Exception as e:
+            logger.error("Falha ao baixar stems de piano: %s: %s", type(e).__name__, e)
+            # formatar o traceback lê arquivos-fonte e percorre a pilha: só no nível DEBUG
+            logger.debug("Traceback (mais detalhes):", exc_info=True)
+    else:
+        logger.info("Nenhum piano no resultado remoto; buscando arquivos locais em %s", cache_dir)
+
+    # sem piano no resultado remoto (ou falha no download): usa stems já presentes no cache
+    if not local_files:
+        piano_glob = find_local_piano_stems(cache_dir)
+        if not piano_glob:
+            logger.warning("create_first_midi: nenhum stem de piano encontrado (remoto ou local); abortando geração de MIDI")
+            return None
+        local_files = {f"piano_{i}": p for i, p in enumerate(piano_glob)}
+        logger.info("Usando stems locais: %s", piano_glob)
+
+    # normaliza o nome do primeiro stem para <id>_piano.<ext> na pasta de cache
+    downloaded = next(iter(local_files.values()))
+    _, ext = os.path.splitext(downloaded)
+    video_id = os.path.basename(cache_dir.rstrip(os.sep))
+    piano_target = os.path.join(cache_dir, f"{video_id}_piano{ext}")
     try:
-        # Normaliza input: às vezes `result_files` é o job_result completo e as chaves reais
-        # estão sob 'results', 'artifacts' ou 'outputs'. Tentamos extrair o dicionário de arquivos.
-        candidates = None
-        if not isinstance(result_files, dict):
-            print('[WARN] create_first_midi_bytes: result_files inesperado (não dict)')
-            return None, None
-
-        for key in ('results', 'artifacts', 'files', 'outputs'):
-            if key in result_files and isinstance(result_files[key], dict):
-                candidates = result_files[key]
-                break
+        os.replace(downloaded, piano_target)
+    except Exception:
+        try:
+            shutil.copy(downloaded, piano_target)
+        except Exception:
+            piano_target = downloaded
+    local_files = {k: (piano_target if p == downloaded else p) for k, p in local_files.items()}
+
+    logger.info("Gerando MIDI de alta precisão...")
+    # usa os caminhos retornados pela geração em vez de varrer a pasta de novo
+    midi_files = generate_midis_from_audios(local_files.values(), cache_dir)
+    if not midi_files:
+        return None
 
-        if candidates is None:
-            # se não encontrou sub-dict, assume que recebeu diretamente o map
-            candidates = result_files
+    return midi_files[0]
 
-        piano_files_map = filter_piano_stem(candidates)
+def job_cache_dir(job_id: str, create: bool = True) -> str:
+    """Pasta de cache para jobs sem vídeo do YouTube associado."""
+    safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', job_id)
+    path = os.path.join(CACHE_DIR, "jobs", safe_id)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
 
-        if not piano_files_map:
-            # tentativa: se um cache_dir foi fornecido, procurar por arquivos locais *_piano.*
-            if cache_dir:
-                print(f"[INFO] Nenhum piano no resultado remoto; buscando arquivos locais em {cache_dir}")
-                piano_glob = glob.glob(os.path.join(cache_dir, "**", "*_piano.*"), recursive=True)
-                if not piano_glob:
-                    piano_glob = glob.glob(os.path.join(cache_dir, "**", "*piano*.*"), recursive=True)
-                if piano_glob:
-                    # montar um mapa semelhante ao que music_ai.download_job_results retornaria
-                    local_files = {}
-                    for i, p in enumerate(piano_glob):
-                        local_files[f"piano_{i}"] = p
-                    print(f"[INFO] Encontrados stems locais: {piano_glob}")
-                else:
-                    print('[WARN] create_first_midi_bytes: nenhum stem de piano detectado; abortando geração de MIDI')
-                    return None, None
-            else:
-                print('[WARN] create_first_midi_bytes: nenhum stem de piano detectado; abortando geração de MIDI')
-                return None, None
-        else:
-            print("[INFO] Baixando stem de piano para gerar MIDI...")
-            try:
-                # Passamos o job/result completo para a SDK (evita KeyError 'status')
-                all_local = music_ai.download_job_results(result_files, output_dir)
-            except Exception as e:
-                print(f"[ERROR] Falha ao baixar stems de piano: {e}")
-                print("[TRACE] Traceback (mais detalhes):")
-                traceback.print_exc()
-                all_local = {}
-
-            # Filtra apenas os arquivos locais que contenham 'piano' no nome
-            local_files = {}
-            for k, v in (all_local or {}).items():
-                candidate_name = os.path.basename(v).lower() if isinstance(v, str) else str(k).lower()
-                if 'piano' in candidate_name or 'piano' in str(k).lower():
-                    local_files[k] = v
-
-            # Se não encontrou nenhum stem remoto, tentar usar arquivos locais em cache_dir
-            if not local_files:
-                if cache_dir:
-                    piano_glob = glob.glob(os.path.join(cache_dir, "**", "*_piano.*"), recursive=True)
-                    if not piano_glob:
-                        piano_glob = glob.glob(os.path.join(cache_dir, "**", "*piano*.*"), recursive=True)
-                    if piano_glob:
-                        local_files = {f"piano_{i}": p for i, p in enumerate(piano_glob)}
-                        print(f"[INFO] Usando stems locais como fallback: {piano_glob}")
-                    else:
-                        print('[WARN] create_first_midi_bytes: nenhum stem de piano encontrado após download e fallback local')
-                        return None, None
-                else:
-                    print('[WARN] create_first_midi_bytes: nenhum stem de piano encontrado após download')
-                    return None, None
-
-        # If using a cache_dir, normalize the downloaded stem name to a consistent piano_stem path
-        if cache_dir:
-            # pick first downloaded file
-            downloaded = None
-            for p in local_files.values():
-                downloaded = p
-                break
-            if downloaded:
-                _, ext = os.path.splitext(downloaded)
-                video_id = os.path.basename(cache_dir.rstrip(os.sep))
-                piano_target = os.path.join(cache_dir, f"{video_id}_piano{ext}")
+
+def cached_job_midi_path(job_id: str, youtube_url: str = None) -> str:
+    """Caminho do MIDI em cache do job: na pasta do vídeo ou, sem vídeo, na pasta do job.
+    Não garante que o arquivo exista; serve para as rotas conferirem antes de gerar."""
+    if youtube_url:
+        return cached_paths_for_video(extract_youtube_id(youtube_url))['midi']
+    work_dir = job_cache_dir(job_id, create=False)
+    return os.path.join(work_dir, f"{os.path.basename(work_dir)}.mid")
+
+
+def generate_job_midi(job_id: str, job_result: dict, youtube_url: str = None):
+    """Gera o MIDI do piano de um job e grava no cache do vídeo (ou do job, sem vídeo).
+    Requisições simultâneas para o mesmo job esperam a primeira terminar em vez de
+    rodar a inferência de novo. Retorna o caminho do MIDI em cache ou None.
+    """
+    vid = None
+    if youtube_url:
+        vid = extract_youtube_id(youtube_url)
+        paths = cached_paths_for_video(vid)
+        work_dir, cache_mid_file = paths['dir'], paths['midi']
+    else:
+        work_dir = job_cache_dir(job_id)
+        cache_mid_file = cached_job_midi_path(job_id)
+
+    with job_lock(job_id), dir_file_lock(work_dir):
+        # outra requisição (ou outro worker) pode ter gerado o MIDI enquanto esperávamos o lock
+        if os.path.exists(cache_mid_file):
+            return cache_mid_file
+
+        midi_path = create_first_midi(job_result, work_dir)
+        if not midi_path:
+            return None
+
+        # o MIDI já está no disco: só renomeia para o caminho canônico do cache
+        if midi_path != cache_mid_file:
+            os.replace(midi_path, cache_mid_file)
+        logger.info("MIDI salvo em cache: %s", cache_mid_file)
+
+        if vid:
+            # remove any piano-specific midi to avoid keeping duplicates
+            piano_specific = os.path.join(work_dir, f"{vid}_piano.mid")
+            if os.path.exists(piano_specific) and piano_specific != cache_mid_file:
                 try:
-                    os.replace(downloaded, piano_target)
+                    os.remove(piano_specific)
                 except Exception:
-                    try:
-                        shutil.copy(downloaded, piano_target)
-                    except Exception:
-                        piano_target = downloaded
-                # update local_files to point to piano_target
-                local_files = {k: (piano_target if p == downloaded else p) for k, p in local_files.items()}
-
-        print("[INFO] Gerando MIDI de alta precisão...")
-        for stem_path in local_files.values():
-            generate_midi_from_audio(stem_path, output_dir)
-
-        # procurar arquivos .mid no output_dir
-        midi_files = [os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.lower().endswith('.mid')]
-        if not midi_files:
-            return None, None
-
-        first = midi_files[0]
-        with open(first, 'rb') as f:
-            data = f.read()
-
-        return data, os.path.basename(first)
-    finally:
-        if use_temp:
-            work_dir_ctx.__exit__(None, None, None)
+                    pass
+
+        return cache_mid_file
+
+# ------------------------
+# Geração de MIDI em segundo plano
+# ------------------------
+# A inferência leva de segundos a minutos: roda fora da thread da requisição, que
+# responde 202 enquanto o MIDI não fica pronto (o cliente já faz polling).
+MIDI_WORKERS = int(os.getenv("MIDI_WORKERS", "2"))
+midi_executor = ThreadPoolExecutor(max_workers=MIDI_WORKERS, thread_name_prefix="midi")
+# Só as gerações em andamento ficam aqui: ao terminar, a tarefa se remove. O sucesso
+# fica no cache em disco; falhas ficam em memória por alguns minutos, para o polling
+# receber o erro em vez de disparar a geração de novo a cada consulta.
+MIDI_FAILURE_TTL = 300
+_midi_tasks = {}
+_midi_failures = TTLCache(maxsize=1024, ttl=MIDI_FAILURE_TTL)
+_midi_tasks_guard = threading.Lock()
+
+
+def submit_job_midi(job_id: str, job_result: dict, youtube_url: str = None):
+    """Agenda a geração do MIDI do job (uma única vez por job) e retorna o Future."""
+    with _midi_tasks_guard:
+        future = _midi_tasks.get(job_id)
+        if future is not None:
+            return future
+        _midi_failures.pop(job_id, None)
+        future = midi_executor.submit(generate_job_midi, job_id, job_result, youtube_url)
+        _midi_tasks[job_id] = future
+
+    # fora do guard: se a tarefa já terminou, o callback roda aqui mesmo e pega o guard
+    future.add_done_callback(lambda f: _finish_job_midi(job_id, f))
+    return future
+
+
+def _finish_job_midi(job_id: str, future):
+    if future.exception() is not None:
+        failure = (500, str(future.exception()))
+    elif not future.result():
+        failure = (404, "Nenhum arquivo MIDI encontrado nos resultados")
+    else:
+        failure = None
+    with _midi_tasks_guard:
+        if _midi_tasks.get(job_id) is future:
+            del _midi_tasks[job_id]
+        if failure is not None:
+            _midi_failures[job_id] = failure
+
+
+def job_midi_failure(job_id: str):
+    """(status HTTP, mensagem) da última geração do job, se ela falhou há pouco; senão None."""
+    with _midi_tasks_guard:
+        return _midi_failures.get(job_id)
+
+
+def job_midi_pending(job_id: str) -> bool:
+    with _midi_tasks_guard:
+        return job_id in _midi_tasks
 
 @app.route("/process-youtube", methods=["POST"])
 @jwt_required()
@@ -435,7 +1056,7 @@ def process_youtube():
         return jsonify({"error": "URL é obrigatória"}), 400
 
     try:
-        print(f"[INFO] Baixando do YouTube: {youtube_url}")
+        logger.info("Baixando do YouTube: %s", youtube_url)
         video_id = extract_youtube_id(youtube_url)
 
         # Paths for this video (per-video cache folder)
@@ -443,7 +1064,7 @@ def process_youtube():
 
         # Fallback order: MIDI -> piano stem -> full mp3 -> download+MusicAI
         if os.path.exists(paths['midi']):
-            print(f"[INFO] MIDI em cache encontrado: {paths['midi']}. Pulando reprocessamento.")
+            logger.info("MIDI em cache encontrado: %s. Pulando reprocessamento.", paths['midi'])
             existing = Job.query.filter_by(youtube_url=youtube_url).order_by(Job.id.desc()).first()
             if existing:
                 return jsonify({"message": "Já processado (cache)", "job_id": existing.musicai_job_id, "status": "SUCCEEDED"}), 200
@@ -461,9 +1082,25 @@ def process_youtube():
 
         # If piano stem exists, generate MIDI from it (no need to call MusicAI)
         if os.path.exists(paths['piano_stem']):
-            print(f"[INFO] Encontrado piano stem em cache: {paths['piano_stem']}. Gerando MIDI localmente.")
-            midi_out = generate_midi_from_audio(paths['piano_stem'], paths['dir'])
-            if midi_out:
+            logger.info("Encontrado piano stem em cache: %s. Gerando MIDI localmente.", paths['piano_stem'])
+            # mesma pasta em que generate_job_midi grava: o lock evita duas gerações simultâneas
+            # (inclusive em outro worker) escrevendo e renomeando os mesmos arquivos
+            with dir_file_lock(paths['dir']):
+                if not os.path.exists(paths['midi']):
+                    midi_out = generate_midi_from_audio(paths['piano_stem'], paths['dir'])
+                    if midi_out and os.path.exists(midi_out):
+                        # replace canonical midi file with piano-generated midi
+                        os.replace(midi_out, paths['midi'])
+                        # remove any leftover piano-specific midi to avoid duplicates
+                        piano_specific = os.path.join(paths['dir'], f"{video_id}_piano.mid")
+                        if os.path.exists(piano_specific) and piano_specific != paths['midi']:
+                            try:
+                                os.remove(piano_specific)
+                            except Exception:
+                                pass
+                midi_ready = os.path.exists(paths['midi'])
+
+            if midi_ready:
                 # ensure DB record exists
                 existing = Job.query.filter_by(youtube_url=youtube_url).order_by(Job.id.desc()).first()
                 if existing:
@@ -478,48 +1115,21 @@ def process_youtube():
                     )
                     db.session.add(new_job)
                     db.session.commit()
-                # move or rename generated midi to canonical path
-                gen_midi_path = os.path.join(paths['dir'], os.path.basename(midi_out)) if midi_out else None
-                if gen_midi_path and os.path.exists(gen_midi_path):
-                    try:
-                        # replace canonical midi file with piano-generated midi
-                        os.replace(gen_midi_path, paths['midi'])
-                        # remove any leftover piano-specific midi to avoid duplicates
-                        piano_specific = os.path.join(paths['dir'], f"{video_id}_piano.mid")
-                        if os.path.exists(piano_specific) and piano_specific != paths['midi']:
-                            try:
-                                os.remove(piano_specific)
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
                 return jsonify({"message": "MIDI gerado localmente", "job_id": job_id, "status": "SUCCEEDED"}), 200
 
         # Check cache for downloaded audio (full mp3)
         cached_audio_path = paths['full_mp3']
         if os.path.exists(cached_audio_path):
-            print(f"[INFO] Usando áudio em cache: {cached_audio_path}")
-            with open(cached_audio_path, "rb") as f:
-                audio_bytes = f.read()
-            # write to a temp file for upload
-            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio:
-                temp_audio.write(audio_bytes)
-                temp_path = temp_audio.name
+            logger.info("Usando áudio em cache: %s", cached_audio_path)
         else:
-            audio_bytes = download_youtube_audio_bytes(youtube_url)
-            with open(cached_audio_path, "wb") as cf:
-                cf.write(audio_bytes)
-            print(f"[INFO] Áudio salvo em cache: {cached_audio_path}")
-            # write to a temp file for upload
-            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio:
-                temp_audio.write(audio_bytes)
-                temp_path = temp_audio.name
-
-        print("[INFO] Enviando para MusicAI...")
-        song_url = music_ai.upload_file(temp_path)
-        os.unlink(temp_path)
-
-        print("[INFO] Iniciando Job na MusicAI...")
+            download_youtube_audio(youtube_url, cached_audio_path)
+            logger.info("Áudio salvo em cache: %s", cached_audio_path)
+
+        # envia direto do arquivo em cache (sem cópia temporária nem buffer em memória)
+        logger.info("Enviando para MusicAI...")
+        song_url = music_ai.upload_file(cached_audio_path)
+
+        logger.info("Iniciando Job na MusicAI...")
         job = music_ai.add_job(MUSICAI_WORKFLOW_TITLE, MUSICAI_WORKFLOW_SLUG, {"inputUrl": song_url})
         job_id = job["id"]
 
@@ -539,7 +1149,7 @@ def process_youtube():
         }), 201
 
     except Exception as e:
-        print(f"[ERROR] {e}")
+        logger.error("%s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/jobs/<job_id>", methods=["GET"])
@@ -548,28 +1158,30 @@ def get_job_status_or_download(job_id):
     should_download = request.args.get('download') != 'false'
 
     try:
-        # First, if we have a local job and cached ZIP, prefer that and avoid external API call
+        # MIDI já gerado (cache do vídeo ou do job): responde do disco, sem chamar a API externa
         local_job = Job.query.filter_by(musicai_job_id=job_id).first()
-        if local_job and local_job.youtube_url:
-            vid = extract_youtube_id(local_job.youtube_url)
-            candidate = cached_paths_for_video(vid)['midi']
-            if os.path.exists(candidate):
-                if not should_download:
-                    return jsonify({"status": "SUCCEEDED", "details": {"cached": True}})
-                return send_file(
-                    candidate,
-                    mimetype="audio/midi",
-                    as_attachment=True,
-                    download_name=f"piano_midi_{job_id}.mid"
-                )
+        youtube_url = local_job.youtube_url if local_job else None
+        candidate = cached_job_midi_path(job_id, youtube_url)
+        if os.path.exists(candidate):
+            if not should_download:
+                return jsonify({"status": "SUCCEEDED", "details": {"cached": True}})
+            return send_file(
+                candidate,
+                mimetype="audio/midi",
+                as_attachment=True,
+                download_name=f"piano_midi_{job_id}.mid",
+                conditional=True
+            )
 
         # Otherwise, fall back to remote job status
-        job_result = music_ai.get_job(job_id)
+        job_result = get_job_cached(job_id)
         remote_status = job_result.get("status")
 
-        print(f"[DEBUG] job_result keys: {list(job_result.keys())}")
-        if 'results' in job_result and isinstance(job_result['results'], dict):
-            print(f"[DEBUG] job_result['results'] keys: {list(job_result['results'].keys())}")
+        # roda a cada poll do cliente: só monta o diagnóstico no nível DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("job_result keys: %s", list(job_result.keys()))
+            if 'results' in job_result and isinstance(job_result['results'], dict):
+                logger.debug("job_result['results'] keys: %s", list(job_result['results'].keys()))
 
         if local_job and local_job.status != remote_status:
             local_job.status = remote_status
@@ -579,54 +1191,14 @@ def get_job_status_or_download(job_id):
             if not should_download:
                 return jsonify({"status": "SUCCEEDED", "details": job_result})
 
-            # Attempt to return cached MIDI by youtube id if available
-            local_job = Job.query.filter_by(musicai_job_id=job_id).first()
-            cache_mid_path = None
-            if local_job and local_job.youtube_url:
-                vid = extract_youtube_id(local_job.youtube_url)
-                candidate = cached_paths_for_video(vid)['midi']
-                if os.path.exists(candidate):
-                    cache_mid_path = candidate
-
-            if cache_mid_path:
-                return send_file(
-                    cache_mid_path,
-                    mimetype="audio/midi",
-                    as_attachment=True,
-                    download_name=f"piano_midi_{job_id}.mid"
-                )
-
-            # generate and cache the first MIDI
-            # generate and cache the first MIDI into video cache dir if possible
-            paths = None
-            if local_job and local_job.youtube_url:
-                vid = extract_youtube_id(local_job.youtube_url)
-                paths = cached_paths_for_video(vid)
-            midi_bytes, midi_name = create_first_midi_bytes(job_result, cache_dir=(paths['dir'] if paths else None))
-            if not midi_bytes:
-                return jsonify({"error": "Nenhum arquivo MIDI encontrado nos resultados"}), 404
-            try:
-                if paths:
-                    cache_mid_file = paths['midi']
-                    with open(cache_mid_file, "wb") as f:
-                        f.write(midi_bytes)
-                    print(f"[INFO] MIDI salvo em cache: {cache_mid_file}")
-                    # cleanup piano-specific midi files to avoid duplicates
-                    piano_specific = os.path.join(paths['dir'], f"{vid}_piano.mid")
-                    if os.path.exists(piano_specific) and piano_specific != cache_mid_file:
-                        try:
-                            os.remove(piano_specific)
-                        except Exception:
-                            pass
-            except Exception as e:
-                print(f"[WARN] Não foi possível gravar MIDI em cache: {e}")
-
-            return send_file(
-                io.BytesIO(midi_bytes),
-                mimetype="audio/midi",
-                as_attachment=True,
-                download_name=f"piano_midi_{job_id}.mid"
-            )
+            # o MIDI não está em cache (conferido no início): gera em segundo plano, como em
+            # /jobs/<id>/midi, e o cliente repete a requisição até receber o arquivo
+            failure = job_midi_failure(job_id)
+            if failure is not None:
+                status, message = failure
+                return jsonify({"error": message}), status
+            submit_job_midi(job_id, job_result, youtube_url)
+            return jsonify({"status": "PROCESSING"}), 202
         
         elif remote_status == "FAILED":
              return jsonify({"status": "FAILED", "error": "O processamento falhou na MusicAI"}), 400
@@ -646,72 +1218,60 @@ def get_job_midi(job_id):
     Usado para importar o MIDI diretamente na UI sem precisar baixar o ZIP manualmente.
     """
     try:
-        # Prefer cached ZIP by youtube id first to avoid calling external API
+        # MIDI já gerado (cache do vídeo ou do job): evita chamar a API externa
         local_job = Job.query.filter_by(musicai_job_id=job_id).first()
-        if local_job and local_job.youtube_url:
-            vid = extract_youtube_id(local_job.youtube_url)
-            candidate = cached_paths_for_video(vid)['midi']
-            if os.path.exists(candidate):
-                with open(candidate, 'rb') as f:
-                    midi_bytes = f.read()
-                first_midi_name = os.path.basename(candidate)
-                return send_file(
-                    io.BytesIO(midi_bytes),
-                    mimetype='audio/midi',
-                    as_attachment=False,
-                    download_name=first_midi_name
-                )
+        youtube_url = local_job.youtube_url if local_job else None
+        candidate = cached_job_midi_path(job_id, youtube_url)
+        if os.path.exists(candidate):
+            # direto do disco: ETag/Last-Modified permitem 304 em requisições repetidas
+            return send_file(
+                candidate,
+                mimetype='audio/midi',
+                as_attachment=False,
+                download_name=os.path.basename(candidate),
+                conditional=True
+            )
+
+        # geração em segundo plano que falhou há pouco: devolve o erro sem tentar de novo
+        failure = job_midi_failure(job_id)
+        if failure is not None:
+            status, message = failure
+            return jsonify({"error": message}), status
+
+        if job_midi_pending(job_id):
+            return jsonify({"status": "PROCESSING"}), 202
 
         # Fall back to remote job result if no local cache
-        job_result = music_ai.get_job(job_id)
+        job_result = get_job_cached(job_id)
         remote_status = job_result.get("status")
 
         if remote_status != "SUCCEEDED":
             return jsonify({"error": "Job ainda não concluído"}), 400
 
-        # Generate the first MIDI and cache it
-        # generate the first MIDI and cache it in video folder if possible
-        paths = None
-        if local_job and local_job.youtube_url:
-            vid = extract_youtube_id(local_job.youtube_url)
-            paths = cached_paths_for_video(vid)
-        midi_bytes, midi_name = create_first_midi_bytes(job_result, cache_dir=(paths['dir'] if paths else None))
-        if not midi_bytes:
-            return jsonify({"error": "Nenhum arquivo MIDI encontrado nos resultados"}), 404
-
-        try:
-            if paths:
-                cache_mid_file = paths['midi']
-                with open(cache_mid_file, "wb") as f:
-                    f.write(midi_bytes)
-                print(f"[INFO] MIDI salvo em cache: {cache_mid_file}")
-                # remove any piano-specific midi to avoid keeping duplicates
-                piano_specific = os.path.join(paths['dir'], f"{vid}_piano.mid")
-                if os.path.exists(piano_specific) and piano_specific != cache_mid_file:
-                    try:
-                        os.remove(piano_specific)
-                    except Exception:
-                        pass
-        except Exception as e:
-            print(f"[WARN] Não foi possível gravar MIDI em cache: {e}")
-
-        return send_file(
-            io.BytesIO(midi_bytes),
-            mimetype='audio/midi',
-            as_attachment=False,
-            download_name=midi_name
-        )
+        # generate the first MIDI (cached in video folder if possible) without blocking the request
+        submit_job_midi(job_id, job_result, youtube_url)
+        return jsonify({"status": "PROCESSING"}), 202
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# A lista de workflows muda raramente: mantém em memória por alguns minutos
+WORKFLOWS_CACHE_TTL = 300
+_workflows_cache = TTLCache(maxsize=1, ttl=WORKFLOWS_CACHE_TTL)
+_workflows_lock = threading.Lock()
+
 @app.route("/workflows", methods=["GET"])
 def list_workflows():
     try:
-        workflows = music_ai.list_workflows()
-        if isinstance(workflows, dict) and "data" in workflows:
-            workflows = workflows["data"]
-        formatted = [{"slug": w.get("slug"), "name": w.get("name")} for w in workflows]
+        # o lock evita que várias requisições busquem a lista ao mesmo tempo num cache miss
+        with _workflows_lock:
+            formatted = _workflows_cache.get("workflows")
+            if formatted is None:
+                workflows = music_ai.list_workflows()
+                if isinstance(workflows, dict) and "data" in workflows:
+                    workflows = workflows["data"]
+                formatted = [{"slug": w.get("slug"), "name": w.get("name")} for w in workflows]
+                _workflows_cache["workflows"] = formatted
         return jsonify({"workflows": formatted})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -728,10 +1288,15 @@ def separate_music():
         job_result = music_ai.wait_for_job_completion(job_id)
         if job_result["status"] != "SUCCEEDED":
             return jsonify({"error": "Job failed"}), 500
-        memory_zip = create_zip_with_midi(job_result)
-        return send_file(memory_zip, mimetype="application/zip", as_attachment=True, download_name=f"piano_{job_id}.zip")
+        zip_stream = create_zip_with_midi(job_result)
+        return Response(
+            zip_stream,
+            mimetype="application/zip",
+            headers={"Content-Disposition": f"attachment; filename=piano_{job_id}.zip"}
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
+    init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -18,7 +18,7 @@ class User(db.Model):
 class Job(db.Model):
     __tablename__ = 'jobs'
     id = db.Column(db.Integer, primary_key=True)
-    musicai_job_id = db.Column(db.String(100), nullable=False)
+    musicai_job_id = db.Column(db.String(100), nullable=False, unique=True, index=True)
     youtube_url = db.Column(db.String(500), nullable=True)
     status = db.Column(db.String(50), default="PENDING")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,9 +1,13 @@
 import yt_dlp
 import os
 import tempfile
-import glob
 
-def download_youtube_audio_bytes(url: str) -> bytes:
+def download_youtube_audio(url: str, dest_path: str) -> str:
+    """
+    Baixa o áudio do YouTube como mp3 direto em `dest_path` e retorna o caminho.
+    O arquivo é movido (rename) para o destino, sem passar o conteúdo pela memória.
+    Requer FFmpeg instalado no sistema.
+    """
     ydl_opts = {
         'format': 'bestaudio/best',
         'postprocessors': [{
@@ -13,27 +17,30 @@ def download_youtube_audio_bytes(url: str) -> bytes:
         }],
         'quiet': True,
         'no_warnings': True,
+        # não fica preso indefinidamente numa conexão parada
+        'socket_timeout': 30,
+        # formatos DASH/HLS: baixa vários fragmentos em paralelo
+        'concurrent_fragment_downloads': 4,
+        # link de vídeo dentro de playlist (&list=...): baixa só o vídeo
+        'noplaylist': True,
     }
 
-    with tempfile.TemporaryDirectory() as temp_dir:
+    # pasta temporária ao lado do destino: o os.replace final é um rename no mesmo disco
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(dest_path) or None) as temp_dir:
         ydl_opts['outtmpl'] = os.path.join(temp_dir, '%(id)s.%(ext)s')
         
         try:
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            
-            arquivos = glob.glob(os.path.join(temp_dir, "*.mp3"))
-            if not arquivos:
+                info = ydl.extract_info(url, download=True)
+                # o outtmpl define o nome; o FFmpegExtractAudio só troca a extensão
+                caminho_arquivo = os.path.splitext(ydl.prepare_filename(info))[0] + '.mp3'
+
+            if not os.path.exists(caminho_arquivo):
                 raise FileNotFoundError("O arquivo de áudio não foi gerado corretamente.")
-                
-            caminho_arquivo = arquivos[0]
-            
-            with open(caminho_arquivo, "rb") as f:
-                audio_bytes = f.read()
-                
-            return audio_bytes
 
-        except Exception as e:
-            raise RuntimeError(f"Falha ao baixar áudio: {str(e)}")
+            os.replace(caminho_arquivo, dest_path)
 
+            return dest_path
 
+        except Exception as e:
+            raise RuntimeError(f"Falha ao baixar áudio: {str(e)}")
@@ -27,6 +27,9 @@ import { Button } from "@/components/ui/button"
 import { LogOut, User as UserIcon, Youtube } from "lucide-react"
 import { YouTubeModal } from "@/components/youtube-modal"
 
+// intervalo entre tentativas enquanto o backend gera o MIDI do job (resposta 202)
+const JOB_MIDI_RETRY_MS = 2000
+
 export function MidiPlayer() {
   const API_URL = process.env.NEXT_PUBLIC_API_URL!
   const [midiData, setMidiData] = useState<ParsedMidi | null>(null)
@@ -264,12 +267,21 @@ export function MidiPlayer() {
     // attempt automatic import if token available
     if (!token) return
 
-    (async () => {
+    let cancelled = false
+    let retryTimer: ReturnType<typeof setTimeout> | undefined
+
+    const importJobMidi = async () => {
       try {
         const resMidi = await fetch(`${API_URL}/jobs/${jobIdParam}/midi`, {
           headers: { Authorization: `Bearer ${token}` },
         })
-        if (!resMidi.ok) {
+        if (cancelled) return
+        // 202: o backend ainda está gerando o MIDI em segundo plano — tenta de novo
+        if (resMidi.status === 202) {
+          retryTimer = setTimeout(importJobMidi, JOB_MIDI_RETRY_MS)
+          return
+        }
+        if (resMidi.status !== 200) {
           console.error("Falha ao obter MIDI via job param", await resMidi.text())
           return
         }
@@ -284,7 +296,13 @@ export function MidiPlayer() {
       } catch (e) {
         console.error("Erro ao importar MIDI do job param:", e)
       }
-    })()
+    }
+
+    importJobMidi()
+    return () => {
+      cancelled = true
+      clearTimeout(retryTimer)
+    }
   }, [token, handleFileLoad])
 
   const resetGameState = useCallback(() => {
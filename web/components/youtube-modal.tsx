@@ -5,6 +5,9 @@ import { Button } from "@/components/ui/button"
 import { Youtube, Loader2, Download, AlertCircle } from "lucide-react"
 import { useAuth } from "@/app/context/auth-context"
 const API_URL = process.env.NEXT_PUBLIC_API_URL!
+const POLL_BASE_MS = 2000
+const POLL_CAP_MS = 30000
+const POLL_JITTER_MS = 500
 interface YouTubeModalProps {
   isOpen: boolean
   onClose: () => void
@@ -57,14 +60,30 @@ export function YouTubeModal({ isOpen, onClose, onImportMidi }: YouTubeModalProp
     }
   }
 
-  const pollStatus = async (id: string) => {
-    const interval = setInterval(async () => {
+  const pollStatus = (id: string) => {
+    // backoff exponencial com jitter: evita consultas repetidas enquanto o status não muda
+    // e só agenda a próxima consulta depois que a atual terminar (sem requisições sobrepostas)
+    let attempt = 0
+    let lastStatus: string | null = null
+
+    const scheduleNext = () => {
+      const delay = Math.min(POLL_CAP_MS, POLL_BASE_MS * 2 ** attempt) + Math.random() * POLL_JITTER_MS
+      attempt += 1
+      setTimeout(poll, delay)
+    }
+
+    const poll = async () => {
       try {
         const res = await fetch(`${API_URL}/jobs/${id}?download=false`, {
           headers: { "Authorization": `Bearer ${token}` }
         })
         const data = await res.json()
 
+        if (data.status !== lastStatus) {
+          lastStatus = data.status
+          attempt = 0
+        }
+
         if (data.status === "SUCCEEDED") {
             // não encerrar o polling imediatamente — tentamos obter o .mid
             setStatusMessage("Processamento concluído (stems prontos). Aguardando geração/extração do MIDI do piano...")
@@ -74,7 +93,8 @@ export function YouTubeModal({ isOpen, onClose, onImportMidi }: YouTubeModalProp
                 headers: { "Authorization": `Bearer ${token}` }
               })
 
-              if (res.ok) {
+              // 202: o backend ainda está gerando o MIDI em segundo plano
+              if (res.status === 200) {
                 const blob = await res.blob()
                 const filename = res.headers.get('Content-Disposition')?.split('filename=')?.[1] || `youtube_${id}.mid`
                 const file = new File([blob], filename.replace(/"/g, ''), { type: 'audio/midi' })
@@ -82,28 +102,32 @@ export function YouTubeModal({ isOpen, onClose, onImportMidi }: YouTubeModalProp
                 setImported(true)
                 setStatus("ready")
                 setStatusMessage('MIDI do piano importado. Você pode fechar este modal ou ir para o teclado.')
-                clearInterval(interval)
+                return
               } else {
                 // MIDI ainda não disponível, manter polling e logs
                 setStatusMessage('Stems prontos — aguardando a extração do MIDI do piano...')
+                // geração em andamento: consulta de novo em intervalos curtos
+                if (res.status === 202) attempt = 0
               }
             } catch (e) {
               console.error('Erro ao baixar o MIDI do job:', e)
               setStatusMessage('Erro ao baixar o MIDI do job. Continuando tentativa...')
             }
+            scheduleNext()
           } else if (data.status === "FAILED") {
-          clearInterval(interval)
           setStatus("error")
           setStatusMessage("Falha no processamento da MusicAI.")
         } else {
            console.log("Status:", data.status)
+           scheduleNext()
         }
       } catch (e) {
-        clearInterval(interval)
         setStatus("error")
         setStatusMessage("Erro de conexão ao verificar status.")
       }
-    }, 5000)
+    }
+
+    scheduleNext()
   }
 
   // NOTE: removed manual download flow — modal now shows logs and lets user